@@ -1,15 +1,23 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import csv
-from codecs import escape_decode
-from functools import reduce
+from codecs import escape_decode, lookup
+from contextlib import closing
+from functools import partial, reduce
 from inspect import signature
 from itertools import groupby
-from io import BytesIO
+from io import BufferedReader, BufferedWriter, TextIOWrapper
+import os
 import signal
-import sys
 
 import click
 import ujson
 
+try:
+    import orjson
+except ImportError:  # Optional, used only for writing UTF-8 JSONL
+    orjson = None
+
 from . import bruma, iso, mst
 from .fieldutils import nest_decode, nest_encode, SubfieldParser, \
                         tl2record, record2tl, utf8_fix_nest_decode, \
@@ -18,6 +26,10 @@ from .fieldutils import nest_decode, nest_encode, SubfieldParser, \
 
 DEFAULT_CSV_ENCODING = "utf-8"
 DEFAULT_JSONL_ENCODING = "utf-8"
+DEFAULT_BUFFER_SIZE = 2 ** 18
+DEFAULT_READ_BUFFER = 2 ** 20
+BINARY_JSONL_ENCODINGS = ["utf-8", "ascii"]
+WORKER_BATCH_LEN = 500
 INPUT_PATH = object()
 OUTPUT_PATH = object()
 CMODE_HEADERS = {
@@ -66,7 +78,130 @@ def encoding_option(file_ext, default, **kwargs):
     )
 
 
+buffer_size_option = click.option(
+    "--buffer-size",
+    type=click.IntRange(min=1),
+    metavar="BYTES",
+    default=DEFAULT_BUFFER_SIZE,
+    show_default=True,
+    callback=lambda ctx, param, value:
+        setattr(ctx, "buffer_size", value) or value,
+    is_eager=True,
+    expose_value=False,
+    help="Write buffer size for the output file/stream.",
+)
+
+
+read_buffer_option = click.option(
+    "--read-buffer",
+    type=click.IntRange(min=1),
+    metavar="BYTES",
+    default=DEFAULT_READ_BUFFER,
+    show_default=True,
+    callback=lambda ctx, param, value:
+        setattr(ctx, "read_buffer", value) or value,
+    is_eager=True,
+    expose_value=False,
+    help="Read buffer size for the input file "
+         "(not used for the standard input).",
+)
+
+
+def open_buffered_input(ctx, param, value, mode, encoding=None):
+    """Open the input file/stream like ``click.File``,
+    but with a read buffer of ``ctx.read_buffer`` bytes
+    when it's not the standard input.
+    """
+    if value == "-":
+        return click.File(mode, encoding=encoding)(value, param)
+    try:
+        raw = open(value, "rb", buffering=0)
+    except OSError as exc:
+        raise click.BadParameter(
+            f"Could not open file: {value}: {exc.strerror}",
+            ctx=ctx,
+            param=param,
+        )
+    stream = BufferedReader(raw, buffer_size=ctx.read_buffer)
+    if "b" not in mode:
+        stream = TextIOWrapper(stream, encoding=encoding)
+    ctx.call_on_close(stream.close)
+    return stream
+
+
+class LazyBufferedFile(click.utils.LazyFile):
+    """Lazy output file like the one from ``click.File``,
+    only opened (and truncated) when it's used,
+    but with a write buffer of ``buffer_size`` bytes.
+    """
+    def __init__(self, filename, mode, encoding=None,
+                 buffer_size=DEFAULT_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        super().__init__(filename, mode, encoding=encoding)
+
+    def open(self):
+        if self._f is None:
+            try:
+                raw = open(self.name, "wb", buffering=0)
+            except OSError as exc:
+                raise click.FileError(self.name, hint=exc.strerror)
+            buffered = BufferedWriter(raw, buffer_size=self.buffer_size)
+            if "b" in self.mode:
+                self._f = buffered
+            else:
+                self._f = TextIOWrapper(buffered, encoding=self.encoding,
+                                        line_buffering=raw.isatty())
+        return self._f
+
+
+def bind_on_first_call(factory):
+    """Create a function that calls the one created by ``factory()``,
+    which is called only once, on the first call.
+    This keeps a lazy output file closed
+    while there's nothing to be written in it.
+    """
+    func = None
+
+    def wrapper(*args):
+        nonlocal func
+        if func is None:
+            func = factory()
+        return func(*args)
+
+    return wrapper
+
+
+def open_buffered_output(ctx, param, value, mode, encoding=None):
+    """Open the output file/stream like ``click.File``,
+    but with a write buffer of ``ctx.buffer_size`` bytes.
+    It gets closed (or flushed, for the standard output)
+    when the context gets closed.
+    """
+    if value != "-":
+        result = LazyBufferedFile(value, mode, encoding=encoding,
+                                  buffer_size=ctx.buffer_size)
+        ctx.call_on_close(result.close)
+        return result
+
+    stream = click.File("wb", lazy=False)(value, param)
+    buffered = BufferedWriter(stream, buffer_size=ctx.buffer_size)
+    if "b" in mode:
+        result = buffered
+    else:
+        result = TextIOWrapper(buffered, encoding=encoding,
+                               line_buffering=stream.isatty())
+
+    def close():  # Detaching flushes and keeps the standard output open
+        if result is not buffered:
+            result.detach()
+        buffered.detach()
+
+    ctx.call_on_close(close)
+    return result
+
+
 def file_arg_enc_option(file_ext, mode, default_encoding):
+    decorators = [encoding_option(file_ext, default=default_encoding)]
     arg_kwargs = {}
     if mode is INPUT_PATH:
         arg_name = file_ext + "_input"
@@ -88,21 +223,22 @@ def file_arg_enc_option(file_ext, mode, default_encoding):
         )
     else:
         arg_kwargs["default"] = "-"
+        ctx_attr = file_ext + "_encoding"
         if "w" in mode:
             arg_name = file_ext + "_output"
+            arg_kwargs["callback"] = lambda ctx, param, value: \
+                open_buffered_output(ctx, param, value, mode,
+                                     encoding=getattr(ctx, ctx_attr))
+            decorators.append(buffer_size_option)
         else:
             arg_name = file_ext + "_input"
-        if "b" in mode:
-            arg_kwargs["type"] = click.File(mode)
-        else:
-            ctx_attr = file_ext + "_encoding"
             arg_kwargs["callback"] = lambda ctx, param, value: \
-                click.File(mode, encoding=getattr(ctx, ctx_attr))(value)
+                open_buffered_input(ctx, param, value, mode,
+                                    encoding=getattr(ctx, ctx_attr))
+            decorators.append(read_buffer_option)
 
-    return apply_decorators(
-        encoding_option(file_ext, default=default_encoding),
-        click.argument(arg_name, **arg_kwargs)
-    )
+    decorators.append(click.argument(arg_name, **arg_kwargs))
+    return apply_decorators(*decorators)
 
 
 def iso_bytes_option_with_default(*args, **kwargs):
@@ -157,18 +293,174 @@ def read_json_raw_tl(stream, mode, sfp, encoding, prepend_mfn):
         yield record2tl(record, sfp, mode, prepend_mfn)
 
 
-def write_json(decoded_record, stream, ensure_ascii=False):
-    if isinstance(decoded_record, list):  # Tidy format
-        for item in decoded_record:
-            write_json(item, stream, ensure_ascii=ensure_ascii)
-    else:  # Dict data
-        ujson.dump(
-            decoded_record, stream,
-            ensure_ascii=ensure_ascii,
-            escape_forward_slashes=False,
-        )
-        stream.write("\n")
-        stream.flush()
+def json_line_dumper(encoding):
+    """Create a function that serializes a decoded record dict
+    as a single JSON line.
+    For UTF-8 and ASCII, the line is encoded in a bytes object
+    (using orjson for UTF-8, if installed),
+    otherwise it's a str to be written in a text stream.
+    """
+    encoding = lookup(encoding).name
+    if orjson is not None and encoding == "utf-8":
+        dumps = orjson.dumps
+        return lambda decoded_dict: dumps(decoded_dict) + b"\n"
+
+    dumps = ujson.dumps
+    if encoding in BINARY_JSONL_ENCODINGS:
+        ensure_ascii = encoding == "ascii"
+
+        def dump_line(decoded_dict):
+            return (dumps(
+                decoded_dict,
+                ensure_ascii=ensure_ascii,
+                escape_forward_slashes=False,
+            ) + "\n").encode(encoding)
+    else:
+        def dump_line(decoded_dict):
+            return dumps(
+                decoded_dict,
+                ensure_ascii=False,
+                escape_forward_slashes=False,
+            ) + "\n"
+
+    return dump_line
+
+
+def json_output_stream(stream):
+    """Stream where the lines from ``json_line_dumper`` should be written,
+    which is the underlying binary buffer of the JSONL text stream
+    for UTF-8 and ASCII, skipping its encoding step.
+    """
+    if lookup(stream.encoding).name in BINARY_JSONL_ENCODINGS:
+        return stream.buffer
+    return stream
+
+
+def json_output_method(stream, name):
+    """Get the ``write``/``writelines`` method
+    of the stream from ``json_output_stream``,
+    flushing it after each call when the JSONL text stream
+    is line buffered (e.g. in an interactive terminal),
+    as the binary buffer below it doesn't know about lines.
+    """
+    output = json_output_stream(stream)
+    method = getattr(output, name)
+    if output is stream or not stream.line_buffering:
+        return method
+    flush = output.flush
+
+    def method_and_flush(arg):
+        method(arg)
+        flush()
+
+    return method_and_flush
+
+
+def json_writer(stream, mode):
+    """Create a function that writes a decoded record
+    in the given JSONL text stream,
+    where the record is a tidy list of dicts in the tidy/stidy modes,
+    or a single dict in the other modes.
+    """
+    dump_line = json_line_dumper(stream.encoding)
+
+    def create_writer():
+        if mode in ["tidy", "stidy"]:
+            writelines = json_output_method(stream, "writelines")
+            return lambda decoded_record: writelines(map(dump_line,
+                                                         decoded_record))
+        write = json_output_method(stream, "write")
+        return lambda decoded_record: write(dump_line(decoded_record))
+
+    return bind_on_first_call(create_writer)
+
+
+def dump_json_batch(tl_batch, sfp, mode, decode, encoding, jsonl_encoding):
+    """Decode and serialize a batch of raw tidy list records,
+    returning the list of JSON lines and the exception
+    that stopped it before the end of the batch (or ``None``),
+    so that the lines of the previous records can still be written.
+    This is the task performed by the worker processes.
+    """
+    dump_line = json_line_dumper(jsonl_encoding)
+    tidy = mode in ["tidy", "stidy"]
+    lines = []
+    try:
+        for tl in tl_batch:
+            record = decode(tl2record(tl, sfp, mode), encoding=encoding)
+            if tidy:
+                lines.extend([dump_line(item) for item in record])
+            else:
+                lines.append(dump_line(record))
+    except Exception as exc:
+        return lines, exc
+    return lines, None
+
+
+def iter_batches(iterable, size):
+    """Generate lists with up to ``size`` items from the iterable.
+    If the iterable raises an exception,
+    the incomplete batch is yielded before re-raising it.
+    """
+    batch = []
+    error = None
+    try:
+        for item in iterable:
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+    except Exception as exc:
+        error = exc
+    if batch:
+        yield batch
+    if error is not None:
+        raise error
+
+
+def iter_until_error(iterable, errors):
+    """Generate the items from the iterable,
+    stopping and appending to the ``errors`` list
+    the exception it might raise.
+    """
+    try:
+        yield from iterable
+    except Exception as exc:
+        errors.append(exc)
+
+
+def pop_results(futures, keep):
+    """Generate the results of the futures in the given deque,
+    removing them until there's only ``keep`` futures left.
+    """
+    while len(futures) > keep:
+        yield futures.popleft().result()
+
+
+def parallel_map(func, iterable, workers):
+    """Lazy and ordered alternative to ``ProcessPoolExecutor.map``,
+    which doesn't consume the entire input iterable beforehand.
+    The number of pending tasks is kept up to twice the workers.
+    If the iterable raises an exception,
+    the results of all the items it had already generated
+    are yielded before re-raising it.
+    An exception from a task is raised as soon as its result is due,
+    cancelling the pending tasks.
+    """
+    errors = []
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        try:
+            for item in iter_until_error(iterable, errors):
+                pending.append(executor.submit(func, item))
+                yield from pop_results(pending, 2 * workers - 1)
+            yield from pop_results(pending, 0)
+        except BaseException:  # Including GeneratorExit
+            for future in pending:
+                future.cancel()
+            raise
+    if errors:
+        raise errors[0]
 
 
 iso_options = [
@@ -545,6 +837,21 @@ utf8_fix_option = click.option(
 )
 
 
+workers_option = click.option(
+    "--workers",
+    type=click.IntRange(min=0),
+    default=1,
+    show_default=True,
+    callback=lambda ctx, param, value: value or os.cpu_count() or 1,
+    help="Number of worker processes "
+         "for decoding and serializing the records, "
+         "in batches, while the main process parses the input "
+         "and writes the output. "
+         "If 1, everything happens in the main process. "
+         "If 0, the number of CPUs is used.",
+)
+
+
 xylose_option = click.option(
     "--xylose",
     is_eager=True,  # Because --mode is eager as well
@@ -578,9 +885,8 @@ def main():
     (e.g. "m2j" instead of "mst2jsonl"),
     where "bruma-" gets replaced by a single "b".
     """
-    try:  # Fix BrokenPipeError by opening a new fake standard output
-        signal.signal(signal.SIGPIPE,
-                      lambda signum, frame: setattr(sys, "stdout", BytesIO()))
+    try:  # Fix BrokenPipeError by exiting silently like most CLI tools
+        signal.signal(signal.SIGPIPE, signal.SIG_DFL)
     except (AttributeError, ValueError):
         pass  # No SIGPIPE in this OS
 
@@ -595,14 +901,14 @@ def main():
 @file_arg_enc_option("jsonl", "w", DEFAULT_JSONL_ENCODING)
 def bruma_mst2jsonl(mst_input, jsonl_output, mst_encoding, mode, **kwargs):
     """MST+XRF to JSON Lines based on Bruma (requires Java)."""
-    ensure_ascii = jsonl_output.encoding.lower() == "ascii"
+    write_json = json_writer(jsonl_output, mode)
     kwargs_menc = {key: kwargs[key].decode(mst_encoding)
                    for key in ["prefix", "first"]}
     sfp = kw_call(SubfieldParser, **{**kwargs, **kwargs_menc})
     itl = kw_call(bruma.iter_tl, mst_input, **kwargs, encoding=mst_encoding)
     for tl_decoded in itl:
         record = tl2record(tl_decoded, sfp, mode)
-        write_json(record, jsonl_output, ensure_ascii=ensure_ascii)
+        write_json(record)
 
 
 @main.command()
@@ -614,17 +920,35 @@ def bruma_mst2jsonl(mst_input, jsonl_output, mst_encoding, mode, **kwargs):
 @xylose_option
 @apply_decorators(*subfield_options)
 @utf8_fix_option
+@workers_option
 @file_arg_enc_option("mst", "rb", mst.DEFAULT_MST_ENCODING)
 @file_arg_enc_option("jsonl", "w", DEFAULT_JSONL_ENCODING)
-def mst2jsonl(mst_input, jsonl_output, mst_encoding, mode, utf8_fix, **kwargs):
+def mst2jsonl(mst_input, jsonl_output, mst_encoding, mode, utf8_fix,
+              workers, **kwargs):
     """ISIS/FFI Master File Format to JSON Lines."""
-    ensure_ascii = jsonl_output.encoding.lower() == "ascii"
     mst_sc = kw_call(mst.StructCreator, **kwargs)
     sfp = kw_call(SubfieldParser, **kwargs)
     decode = utf8_fix_nest_decode if utf8_fix else nest_decode
-    for tl in kw_call(mst_sc.iter_raw_tl, mst_input, **kwargs):
-        record = decode(tl2record(tl, sfp, mode), encoding=mst_encoding)
-        write_json(record, jsonl_output, ensure_ascii=ensure_ascii)
+    tl_gen = kw_call(mst_sc.iter_raw_tl, mst_input, **kwargs)
+    if workers == 1:
+        write_json = json_writer(jsonl_output, mode)
+        for tl in tl_gen:
+            record = decode(tl2record(tl, sfp, mode), encoding=mst_encoding)
+            write_json(record)
+    else:
+        dump_batch = partial(dump_json_batch, sfp=sfp, mode=mode,
+                             decode=decode, encoding=mst_encoding,
+                             jsonl_encoding=jsonl_output.encoding)
+        tl_batches = iter_batches(tl_gen, WORKER_BATCH_LEN)
+        writelines = bind_on_first_call(
+            lambda: json_output_method(jsonl_output, "writelines")
+        )
+        results = parallel_map(dump_batch, tl_batches, workers)
+        with closing(results):
+            for lines, error in results:
+                writelines(lines)
+                if error is not None:
+                    raise error
 
 
 @main.command()
@@ -664,13 +988,13 @@ def jsonl2mst(jsonl_input, mst_output, mst_encoding, mode, ftf, **kwargs):
 @file_arg_enc_option("jsonl", "w", DEFAULT_JSONL_ENCODING)
 def iso2jsonl(iso_input, jsonl_output, iso_encoding, mode, utf8_fix, **kwargs):
     """ISO2709 to JSON Lines."""
-    ensure_ascii = jsonl_output.encoding.lower() == "ascii"
+    write_json = json_writer(jsonl_output, mode)
     kwargs["record_struct"] = kw_call(iso.create_record_struct, **kwargs)
     sfp = kw_call(SubfieldParser, **kwargs)
     decode = utf8_fix_nest_decode if utf8_fix else nest_decode
     for tl in kw_call(iso.iter_raw_tl, iso_input, **kwargs):
         record = decode(tl2record(tl, sfp, mode), encoding=iso_encoding)
-        write_json(record, jsonl_output, ensure_ascii=ensure_ascii)
+        write_json(record)
 
 
 @main.command()
@@ -693,10 +1017,10 @@ def jsonl2iso(jsonl_input, iso_output, iso_encoding, mode, ftf, **kwargs):
         encoding=iso_encoding,
         prepend_mfn=False,
     )
+    build = record_struct.build
+    write = bind_on_first_call(lambda: iso_output.write)
     for tl in tl_gen:
-        iso_bytes = record_struct.build(tl2con(tl, ftf))
-        iso_output.write(iso_bytes)
-        iso_output.flush()
+        write(build(tl2con(tl, ftf)))
 
 
 @main.command("bruma-mst2csv")
@@ -814,10 +1138,10 @@ def csv2iso(csv_input, iso_output, iso_encoding, cmode, ftf, **kwargs):
         encoding=iso_encoding,
         prepend_mfn=False,
     )
+    build = record_struct.build
+    write = bind_on_first_call(lambda: iso_output.write)
     for tl in tl_gen:
-        iso_bytes = record_struct.build(tl2con(tl, ftf))
-        iso_output.write(iso_bytes)
-        iso_output.flush()
+        write(build(tl2con(tl, ftf)))
 
 
 @main.command()
@@ -861,7 +1185,7 @@ def jsonl2csv(jsonl_input, csv_output, mode, cmode, **kwargs):
 @file_arg_enc_option("jsonl", "w", DEFAULT_JSONL_ENCODING)
 def csv2jsonl(csv_input, jsonl_output, mode, cmode, **kwargs):
     """CSV to JSON Lines."""
-    ensure_ascii = jsonl_output.encoding.lower() == "ascii"
+    write_json = json_writer(jsonl_output, mode)
     kwargs_menc = {key: kwargs[key].decode(jsonl_output.encoding)
                    for key in ["prefix", "first"]}
     sfp = kw_call(SubfieldParser, **{**kwargs, **kwargs_menc},
@@ -870,7 +1194,7 @@ def csv2jsonl(csv_input, jsonl_output, mode, cmode, **kwargs):
     for crecord in record_gen:  # Encoding is handled by the file I/O
         tl = record2tl(crecord, sfp, cmode, prepend_mfn=True)
         jrecord = tl2record(tl, sfp, mode)
-        write_json(jrecord, jsonl_output, ensure_ascii=ensure_ascii)
+        write_json(jrecord)
 
 
 if __name__ == "__main__":
@@ -1,5 +1,7 @@
-from collections import Counter, defaultdict
+from collections import defaultdict
+from functools import lru_cache
 from itertools import cycle, groupby, zip_longest
+from operator import methodcaller
 import re
 
 
@@ -217,6 +219,26 @@ def tl2con(tl, ftf):
     return container
 
 
+# Rendered subfield key number suffixes for the most common counts
+_SUFFIXES = {
+    str: ["%d" % idx for idx in range(256)],
+    bytes: [b"%d" % idx for idx in range(256)],
+}
+
+
+@lru_cache(maxsize=256)
+def _subfields_regex(prefix, length):
+    """Compiled regex to find the subfields ``(key, value)`` pairs,
+    cached since several SubfieldParser instances
+    might share the same prefix and key length.
+    """
+    regex_str = b"(?:^|(?<=%s(.{%d})))((?:(?!%s.{%d}).)*)"
+    if isinstance(prefix, str):
+        regex_str = regex_str.decode("ascii")
+    regex_str %= (re.escape(prefix), length) * 2
+    return re.compile(regex_str, re.DOTALL)
+
+
 class SubfieldParser:
     """Generate subfield pairs from the given value on calling.
 
@@ -275,18 +297,20 @@ class SubfieldParser:
         self.zero = zero
         self.check = check
 
-        escaped_prefix = re.escape(prefix)
-        regex_str = b"(?:^|(?<=%s(.{%d})))((?:(?!%s.{%d}).)*)"
-        if isinstance(prefix, str):
-            regex_str = regex_str.decode("ascii")
-            self.percent_d = "%d"
-        else:
-            self.percent_d = b"%d"
-        regex_str %= (escaped_prefix, length) * 2
-        self.subfields_regex = re.compile(regex_str, re.DOTALL)
+        self.subfields_regex = _subfields_regex(prefix, length)
+
+        # Splitting the field is the same to using the regex
+        # when the prefix occurrences can't overlap,
+        # i.e., when no prefix "head" is also a prefix "tail"
+        self.split = bool(prefix) and not any(
+            prefix[:idx] == prefix[-idx:] for idx in range(1, len(prefix))
+        )
+        self._prefix2 = prefix * 2
+        self.percent_d = "%d" if isinstance(prefix, str) else b"%d"
+        self._suffixes = _SUFFIXES[type(self.percent_d)]
 
         if first is None:
-            self.first = regex_str[:0]  # Empty bytes or str
+            self.first = prefix[:0]  # Empty bytes or str
         elif lower:
             self.first = first.lower()
         else:
@@ -299,20 +323,85 @@ class SubfieldParser:
 
     def __call__(self, field):
         """Generate (key, value) pairs for each subfields in a field."""
-        key_count = Counter()
-        for key, value in self.subfields_regex.findall(field):
-            if self.empty or value:
+        # Attributes as local names, avoiding lookups in the loop
+        empty, first, lower = self.empty, self.first, self.lower
+        number, zero, percent_d = self.number, self.zero, self.percent_d
+        suffixes = self._suffixes
+        key_count = {}
+        key_count_get = key_count.get
+        for key, value in self._raw_pairs(field):
+            if empty or value:
                 if not key:  # PyPy: empty key is always str, not bytes
-                    key = self.first
-                elif self.lower:
+                    key = first
+                elif lower:
                     key = key.lower()
-                if self.number:
-                    suffix_int = key_count[key]
-                    key_count[key] += 1
-                    if self.zero or suffix_int:
-                        key += self.percent_d % suffix_int
+                if number:
+                    suffix_int = key_count_get(key, 0)
+                    key_count[key] = suffix_int + 1
+                    if zero or suffix_int:
+                        key += (suffixes[suffix_int] if suffix_int < 256
+                                else percent_d % suffix_int)
                 yield key, value
 
+    def _raw_pairs(self, field):
+        """Iterable of (key, value) subfield pairs in a field,
+        where the key of the leading value is empty.
+        """
+        parts = self._split_parts(field) if self.split else None
+        if parts is not None:
+            length = self.length
+            pairs = [(part[:length], part[length:]) for part in parts]
+            pairs[0] = field[:0], parts[0]
+            return pairs
+        if len(self.prefix) > 1:
+            return self._find_pairs(field)
+        # Lazy matching, the default is the leading value key
+        matches = self.subfields_regex.finditer(field)
+        return map(methodcaller("groups", field[:0]), matches)
+
+    def _split_parts(self, field):
+        """Split the field by the prefix, or get None
+        when a prefix isn't followed by a complete key
+        (i.e., it isn't a subfield mark),
+        as the split would give a different result.
+        """
+        prefix, length = self.prefix, self.length
+        if length == 1:  # Usual case, where a missing key is an empty part
+            if self._prefix2 in field or field.endswith(prefix):
+                return None
+            return field.split(prefix)
+        parts = field.split(prefix)
+        if len(parts) == 1 or min(map(len, parts[1:])) >= length:
+            return parts
+        return None
+
+    def _find_pairs(self, field):
+        """Generate the same pairs the regex would find,
+        but locating every (possibly overlapping) prefix occurrence
+        with the str/bytes ``find`` method,
+        which is faster than the regex for multi-character prefixes.
+        """
+        prefix, length = self.prefix, self.length
+        find, size, end = field.find, len(prefix) + length, len(field)
+        marks = []  # Positions of prefixes followed by a complete key
+        pos = find(prefix)
+        while 0 <= pos <= end - size:
+            marks.append(pos)
+            pos = find(prefix, pos + 1)
+        starts = [0] + [mark + size for mark in marks]  # Of the values
+        marks.append(end)
+        mark_iter = iter(marks)
+        mark = next(mark_iter)
+        next_start = 0
+        for start in starts:
+            if start < next_start:  # Matches can't overlap
+                continue
+            while mark < start:
+                mark = next(mark_iter)
+            key = field[start - length:start] if start else field[:0]
+            yield key, field[start:mark]
+            next_start = mark if mark > start else start + 1
+
     def unparse(self, *subfields, check=_EMPTY):
         """Build the field from the ordered subfield pairs.
 
@@ -37,6 +37,7 @@ setuptools.setup(
         "JPype1",
         "ujson",
     ],
+    extras_require={"orjson": ["orjson"]},
     entry_points={"console_scripts": ["ioisis = ioisis.__main__:main"]},
     classifiers=[
         "Development Status :: 3 - Alpha",
@@ -1,6 +1,12 @@
+from io import BufferedReader, BufferedWriter, BytesIO, RawIOBase, \
+               TextIOWrapper
+import re
+
 from click.testing import CliRunner
+import pytest
 
-from ioisis.__main__ import iso2jsonl, jsonl2iso
+from ioisis.__main__ import iso2jsonl, jsonl2iso, jsonl2mst, mst2jsonl, \
+                            json_writer
 
 
 simple_example_jsonl = (
@@ -10,6 +16,19 @@ simple_example_jsonl = (
     b'{"1":["x"],"10":["y","z"],"100":["aa","bbb","cccc"]}\n'
 )
 
+simple_example_tidy_jsonl = (
+    b'{"mfn":1,"index":0,"tag":"1","data":"a"}\n'
+    b'{"mfn":2,"index":0,"tag":"10","data":"test"}\n'
+    b'{"mfn":2,"index":1,"tag":"10","data":"one"}\n'
+    b'{"mfn":2,"index":2,"tag":"11","data":"two"}\n'
+    b'{"mfn":4,"index":0,"tag":"1","data":"x"}\n'
+    b'{"mfn":4,"index":1,"tag":"10","data":"y"}\n'
+    b'{"mfn":4,"index":2,"tag":"10","data":"z"}\n'
+    b'{"mfn":4,"index":3,"tag":"100","data":"aa"}\n'
+    b'{"mfn":4,"index":4,"tag":"100","data":"bbb"}\n'
+    b'{"mfn":4,"index":5,"tag":"100","data":"cccc"}\n'
+)
+
 simple_example_iso = (
     b"000400000000000370004500001000200000#a##\n"
     b"000750000000000610004500"
@@ -35,3 +54,232 @@ def test_iso2jsonl_simple_example_on_standard_streams():
     assert result.exit_code == 0
     assert result.stdout_bytes == simple_example_jsonl
     assert result.stderr_bytes == b""
+
+
+@pytest.fixture(params=["orjson", "ujson"])
+def json_backend(request, monkeypatch):
+    """Run the test with and without orjson for UTF-8 JSONL."""
+    if request.param == "ujson":
+        monkeypatch.setattr("ioisis.__main__.orjson", None)
+    return request.param
+
+
+def test_iso2jsonl_non_ascii_without_escaping_slashes(json_backend):
+    runner = CliRunner(mix_stderr=False)
+    iso_data = b"000420000000000370004500001000400000#a/\xe9##\n"
+    result = runner.invoke(iso2jsonl, input=iso_data)
+    assert result.exit_code == 0
+    assert result.stdout_bytes == '{"1":["a/é"]}\n'.encode("utf-8")
+    result_ascii = runner.invoke(iso2jsonl, ["--jenc=ascii"], input=iso_data)
+    assert result_ascii.exit_code == 0
+    assert result_ascii.stdout_bytes == b'{"1":["a/\\u00e9"]}\n'
+
+
+@pytest.mark.parametrize("mode, expected", [
+    ("field", simple_example_jsonl),
+    ("tidy", simple_example_tidy_jsonl),
+])
+@pytest.mark.parametrize("workers", ["1", "2"])
+def test_jsonl2mst2jsonl_simple_example_workers(tmp_path, workers,
+                                                mode, expected):
+    mst_path = str(tmp_path / "simple_example.mst")
+    runner = CliRunner(mix_stderr=False)
+    result_mst = runner.invoke(jsonl2mst, ["-", mst_path],
+                               input=simple_example_jsonl)
+    assert result_mst.exit_code == 0
+    result = runner.invoke(mst2jsonl,
+                           ["--workers", workers, "-m", mode, mst_path])
+    assert result.exit_code == 0
+    assert result.stdout_bytes == expected
+    assert result.stderr_bytes == b""
+
+
+def test_jsonl2iso_invalid_input_keeps_existing_output_file(tmp_path):
+    iso_path = tmp_path / "existing.iso"
+    iso_path.write_bytes(simple_example_iso)
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(jsonl2iso, ["-", str(iso_path)],
+                           input=b"not JSON\n")
+    assert result.exit_code != 0
+    assert iso_path.read_bytes() == simple_example_iso
+
+
+@pytest.mark.parametrize("buffer_size", ["1", "16", "1024"])
+def test_iso2jsonl_jsonl2iso_output_files_buffer_size(tmp_path, buffer_size):
+    jsonl_path = str(tmp_path / "simple_example.jsonl")
+    iso_path = str(tmp_path / "simple_example.iso")
+    runner = CliRunner(mix_stderr=False)
+    result_jsonl = runner.invoke(
+        iso2jsonl, ["--buffer-size", buffer_size, "-", jsonl_path],
+        input=simple_example_iso,
+    )
+    assert result_jsonl.exit_code == 0
+    with open(jsonl_path, "rb") as jsonl_file:
+        assert jsonl_file.read() == simple_example_jsonl
+    result_iso = runner.invoke(
+        jsonl2iso, ["--buffer-size", buffer_size, "-", iso_path],
+        input=simple_example_jsonl,
+    )
+    assert result_iso.exit_code == 0
+    with open(iso_path, "rb") as iso_file:
+        assert iso_file.read() == simple_example_iso
+
+
+@pytest.mark.parametrize("buffer_size", ["0", "-5"])
+def test_jsonl2iso_invalid_buffer_size(buffer_size):
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(jsonl2iso, ["--buffer-size", buffer_size],
+                           input=simple_example_jsonl)
+    assert result.exit_code == 2
+    assert "--buffer-size" in result.stderr
+    assert result.stdout_bytes == b""
+
+
+@pytest.mark.parametrize("encoding", ["utf-8", "ascii", "latin1"])
+@pytest.mark.parametrize("mode", ["field", "tidy"])
+def test_json_writer_line_buffering(json_backend, encoding, mode):
+    raw = BytesIO()
+    stream = TextIOWrapper(BufferedWriter(raw, buffer_size=2 ** 18),
+                           encoding=encoding, line_buffering=True)
+    write_json = json_writer(stream, mode)
+    if mode == "tidy":
+        write_json([{"mfn": 1, "tag": "1", "data": "a"}])
+        expected = b'{"mfn":1,"tag":"1","data":"a"}\n'
+    else:
+        write_json({"1": ["a"]})
+        expected = b'{"1":["a"]}\n'
+    assert raw.getvalue() == expected  # Written without an explicit flush
+
+
+@pytest.mark.parametrize("read_buffer", ["1", "16", "1024"])
+def test_jsonl2iso_iso2jsonl_input_files_read_buffer(tmp_path, read_buffer):
+    jsonl_path = tmp_path / "simple_example.jsonl"
+    jsonl_path.write_bytes(simple_example_jsonl)
+    iso_path = tmp_path / "simple_example.iso"
+    iso_path.write_bytes(simple_example_iso)
+    runner = CliRunner(mix_stderr=False)
+    result_iso = runner.invoke(
+        jsonl2iso, ["--read-buffer", read_buffer, str(jsonl_path)],
+    )
+    assert result_iso.exit_code == 0
+    assert result_iso.stdout_bytes == simple_example_iso
+    result_jsonl = runner.invoke(
+        iso2jsonl, ["--read-buffer", read_buffer, str(iso_path)],
+    )
+    assert result_jsonl.exit_code == 0
+    assert result_jsonl.stdout_bytes == simple_example_jsonl
+
+
+@pytest.mark.parametrize("read_buffer", ["0", "-5"])
+def test_iso2jsonl_invalid_read_buffer(read_buffer):
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(iso2jsonl, ["--read-buffer", read_buffer],
+                           input=simple_example_iso)
+    assert result.exit_code == 2
+    assert "--read-buffer" in result.stderr
+    assert result.stdout_bytes == b""
+
+
+def test_mst2jsonl_workers_keep_records_before_invalid_data(tmp_path,
+                                                            monkeypatch):
+    monkeypatch.setattr("ioisis.__main__.WORKER_BATCH_LEN", 7)
+    mst_path = tmp_path / "corrupted.mst"
+    jsonl_data = b"".join(b'{"1":["record %d"]}\n' % idx
+                          for idx in range(1, 101))
+    runner = CliRunner(mix_stderr=False)
+    result_mst = runner.invoke(jsonl2mst, ["-", str(mst_path)],
+                               input=jsonl_data)
+    assert result_mst.exit_code == 0
+    mst_data = bytearray(mst_path.read_bytes())
+    middle = len(mst_data) // 2
+    mst_data[middle:middle + 64] = b"\xff" * 64
+    mst_path.write_bytes(mst_data)
+
+    results = [runner.invoke(mst2jsonl, ["--workers", workers, str(mst_path)])
+               for workers in ["1", "2"]]
+    assert all(result.exit_code != 0 for result in results)
+    expected = results[0].stdout_bytes
+    assert 0 < expected.count(b"\n") < 100
+    assert jsonl_data.startswith(expected)
+    assert results[1].stdout_bytes == expected
+
+
+def test_iso2jsonl_missing_input_file(tmp_path):
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(iso2jsonl, [str(tmp_path / "missing.iso")])
+    assert result.exit_code == 2
+    assert "Could not open file" in result.stderr
+    assert result.stdout_bytes == b""
+
+
+def test_mst2jsonl_workers_stop_at_the_undecodable_record(tmp_path,
+                                                          monkeypatch):
+    monkeypatch.setattr("ioisis.__main__.WORKER_BATCH_LEN", 5)
+    mst_path = str(tmp_path / "undecodable.mst")
+    jsonl_data = "".join('{"1":["record %d%s"]}\n' % (idx, "\x81" * (idx == 7))
+                         for idx in range(1, 26)).encode("utf-8")
+    runner = CliRunner(mix_stderr=False)
+    result_mst = runner.invoke(jsonl2mst, ["--menc", "latin1", "-", mst_path],
+                               input=jsonl_data)
+    assert result_mst.exit_code == 0
+
+    expected = b"".join(b'{"1":["record %d"]}\n' % idx for idx in range(1, 7))
+    for workers in ["1", "2", "3"]:
+        result = runner.invoke(mst2jsonl, ["--workers", workers, mst_path])
+        assert isinstance(result.exception, UnicodeDecodeError)
+        assert result.stdout_bytes == expected
+
+
+def test_mst2jsonl_workers_zero_without_cpu_count(tmp_path, monkeypatch):
+    monkeypatch.setattr("os.cpu_count", lambda: None)
+    mst_path = str(tmp_path / "simple_example.mst")
+    runner = CliRunner(mix_stderr=False)
+    result_mst = runner.invoke(jsonl2mst, ["-", mst_path],
+                               input=simple_example_jsonl)
+    assert result_mst.exit_code == 0
+    result = runner.invoke(mst2jsonl, ["--workers", "0", mst_path])
+    assert result.exit_code == 0
+    assert result.stdout_bytes == simple_example_jsonl
+
+
+class LineByLineRawInput(RawIOBase):
+    """Raw input stream that reads a single line at a time,
+    storing the output file size before reading each line.
+    """
+    def __init__(self, data, output_path):
+        self.lines = iter(data.splitlines(keepends=True))
+        self.output_path = output_path
+        self.output_sizes = []
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        self.output_sizes.append(
+            self.output_path.stat().st_size
+            if self.output_path.exists() else 0
+        )
+        line = next(self.lines, b"")
+        buffer[:len(line)] = line
+        return len(line)
+
+
+@pytest.mark.parametrize("buffer_size, flushed", [("1", True),
+                                                  ("1024", False)])
+def test_jsonl2iso_buffer_size_flushes_the_output(tmp_path,
+                                                  buffer_size, flushed):
+    iso_path = tmp_path / "simple_example.iso"
+    raw_input = LineByLineRawInput(simple_example_jsonl, iso_path)
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(
+        jsonl2iso, ["--buffer-size", buffer_size, "-", str(iso_path)],
+        input=BufferedReader(raw_input),
+    )
+    assert result.exit_code == 0
+    assert iso_path.read_bytes() == simple_example_iso
+    record_ends = [0] + [match.end() for match
+                         in re.finditer(b"##\n", simple_example_iso)]
+    if flushed:  # Each record is written before reading the next line
+        assert raw_input.output_sizes == record_ends
+    else:
+        assert set(raw_input.output_sizes) == {0}
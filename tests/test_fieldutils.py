@@ -293,3 +293,12 @@ def test_sfp_unparse_check(field, expected, kwargs):
     if not can_check:
         with pytest.raises(ValueError):
             sfp.unparse(*unexpected, check=True)
+
+
+@pytest.mark.parametrize("prefix, field, expected", [
+    ("^", "a^^b^c", [("", "a"), ("^", "b"), ("b", ""), ("c", "")]),
+    (b"^", b"a^^b^c", [(b"", b"a"), (b"^", b"b"), (b"b", b""), (b"c", b"")]),
+])
+def test_sfp_call_prefix_in_key_not_resynthesizable(prefix, field, expected):
+    sfp = SubfieldParser(prefix, empty=True, number=False)
+    assert list(sfp(field)) == expected